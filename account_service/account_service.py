@@ -1,21 +1,35 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, status, Query
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
+from typing import List
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import Column, Integer, String, select
+from sqlalchemy import Column, Integer, String, select, lambda_stmt
 from jose import JWTError, jwt
-import datetime
+from cachetools import TTLCache
+from passlib.context import CryptContext
+import asyncio
+import os
+import time
 from contextlib import asynccontextmanager
 
 
 DATABASE_URL = 'postgresql+asyncpg://user:password@db:5432/account_db'
-SECRET_KEY = "key"
+SECRET_KEY = os.getenv("JWT_SECRET", "key")
 ALGORITHM = "HS256"
 
-engine = create_async_engine(DATABASE_URL, echo=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AsyncSession)
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=bool(int(os.getenv("SQL_ECHO", "0"))),
+    pool_size=20,
+    max_overflow=10,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    query_cache_size=1200
+)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine, class_=AsyncSession)
 Base = declarative_base()
 
 class User(Base):
@@ -46,9 +60,29 @@ class Token(BaseModel):
     access_token: str
     refresh_token: str
 
+class UserIds(BaseModel):
+    ids: List[int]
+
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/Authentication/SignIn")
 
+
+async def get_token(token: str = Depends(oauth2_scheme)) -> str:
+    return token
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+token_cache = TTLCache(maxsize=10_000, ttl=60)
+
+
+def decode_token(token: str) -> dict:
+    payload = token_cache.get(token)
+    if payload is not None and payload.get("exp", 0) > time.time():
+        return payload
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    token_cache[token] = payload
+    return payload
+
 @asynccontextmanager
 async def create_tables(app: FastAPI):
     async with engine.begin() as conn:
@@ -61,7 +95,7 @@ async def lifespan(app: FastAPI):
     async with create_tables(app):
         yield  #
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 
 async def get_db() -> AsyncSession:
@@ -69,64 +103,128 @@ async def get_db() -> AsyncSession:
         yield db
 
 
-def create_token(data: dict, expires_delta: datetime.timedelta):
-    to_encode = data.copy()
-    to_encode.update({"exp": datetime.datetime.utcnow() + expires_delta})
+def create_token(data: dict, ttl_seconds: int) -> str:
+    to_encode = {**data, "exp": int(time.time()) + ttl_seconds}
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 @app.post("/api/Authentication/SignIn", response_model=Token)
 async def sign_in(username: str, password: str, db: AsyncSession = Depends(get_db)):
-    statement = select(User).where(User.username == username)
+    statement = lambda_stmt(lambda: select(User).where(User.username == username))
     result = await db.execute(statement)
     user = result.scalars().first()
 
-    if not user or user.password != password:
+    if not user or not await asyncio.get_running_loop().run_in_executor(
+        None, pwd_context.verify, password, user.password
+    ):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
 
-    access_token = create_token(
-        {"user_id": user.id, "role": user.role},
-        datetime.timedelta(hours=1)
-    )
-    refresh_token = create_token(
-        {"user_id": user.id, "role": user.role},
-        datetime.timedelta(days=7)
-    )
+    token_data = {
+        "user_id": user.id,
+        "role": user.role,
+        "username": user.username,
+        "firstName": user.first_name,
+        "lastName": user.last_name,
+    }
+    access_token = create_token(token_data, 3600)
+    refresh_token = create_token(token_data, 7 * 86400)
     return {"access_token": access_token, "refresh_token": refresh_token}
 
 
 
 @app.post("/api/Authentication/SignUp", response_model=UserResponse)
 async def sign_up(user: UserCreate, db: AsyncSession = Depends(get_db)):
-    new_user = User(**user.dict())
+    hashed_password = await asyncio.get_running_loop().run_in_executor(
+        None, pwd_context.hash, user.password
+    )
+    new_user = User(
+        username=user.username,
+        password=hashed_password,
+        first_name=user.firstName,
+        last_name=user.lastName,
+        role=user.role,
+    )
     db.add(new_user)
     await db.commit()
-    await db.refresh(new_user)
-    return new_user
+    return UserResponse(
+        id=new_user.id,
+        username=new_user.username,
+        firstName=new_user.first_name,
+        lastName=new_user.last_name,
+        role=new_user.role,
+    )
 
 
 @app.get("/api/Authentication/Validate")
-async def validate_token(token: str = Depends(oauth2_scheme)):
+async def validate_token(token: str = Depends(get_token)):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         return {"valid": True, "user_id": payload.get("user_id")}
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
 
+@app.get("/api/Accounts/roles")
+async def get_account_roles(ids: List[int] = Query(...), token: str = Depends(get_token), db: AsyncSession = Depends(get_db)):
+    try:
+        decode_token(token)
+    except JWTError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+
+    statement = select(User.id, User.role).where(User.id.in_(ids))
+    result = await db.execute(statement)
+    return {row.id: row.role for row in result.all()}
+
+
+@app.post("/api/Accounts/bulk", response_model=List[UserResponse])
+async def get_accounts_bulk(payload: UserIds, token: str = Depends(get_token), db: AsyncSession = Depends(get_db)):
+    try:
+        decode_token(token)
+    except JWTError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+
+    statement = select(User).where(User.id.in_(payload.ids))
+    result = await db.execute(statement)
+    return [
+        UserResponse(
+            id=user.id,
+            username=user.username,
+            firstName=user.first_name,
+            lastName=user.last_name,
+            role=user.role,
+        )
+        for user in result.scalars().all()
+    ]
+
+
 @app.get("/api/Accounts/Me", response_model=UserResponse)
-async def get_me(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+async def get_me(token: str = Depends(get_token), db: AsyncSession = Depends(get_db)):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         user_id = payload.get("user_id")
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
-    statement = select(User).where(User.id == user_id)
+    if "username" in payload:
+        return UserResponse(
+            id=payload["user_id"],
+            username=payload["username"],
+            firstName=payload["firstName"],
+            lastName=payload["lastName"],
+            role=payload["role"],
+        )
+
+    statement = lambda_stmt(lambda: select(User).where(User.id == user_id))
     result = await db.execute(statement)
     user = result.scalars().first()
 
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    return user
+    return UserResponse(
+        id=user.id,
+        username=user.username,
+        firstName=user.first_name,
+        lastName=user.last_name,
+        role=user.role,
+    )
@@ -1,23 +1,44 @@
 from fastapi import FastAPI, Depends, HTTPException, status
-from sqlmodel import SQLModel, Field, create_engine, Session, select
+from fastapi.responses import ORJSONResponse
+from sqlmodel import SQLModel, Field, select
+from sqlalchemy import lambda_stmt
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
 from typing import List, Optional
 from datetime import datetime
-from httpx import AsyncClient
+from httpx import AsyncClient, Limits
+from cachetools import TTLCache
+from jose import JWTError, jwt
+import redis.asyncio as aioredis
 from contextlib import asynccontextmanager
+import asyncio
+import os
+import time
 
 
 DATABASE_URL = 'postgresql+asyncpg://user:password@db:5432/document_db'
-AUTH_SERVICE_URL = 'http://localhost:8081/api/Authentication/Validate'
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+SECRET_KEY = os.getenv("JWT_SECRET", "key")
+ALGORITHM = "HS256"
 ACCOUNT_SERVICE_URL = 'http://localhost:8081/api/Accounts/'
 HOSPITAL_SERVICE_URL = 'http://localhost:8082/api/Hospitals/'
 
 
-engine = create_engine(DATABASE_URL, echo=True, future=True)
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=bool(int(os.getenv("SQL_ECHO", "0"))),
+    pool_size=20,
+    max_overflow=10,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    query_cache_size=1200
+)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine, class_=AsyncSession)
 
 class History(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     date: datetime
-    pacient_id: int
+    pacient_id: int = Field(index=True)
     hospital_id: int
     doctor_id: int
     room: str
@@ -41,47 +62,81 @@ class HistoryUpdate(SQLModel):
 
 
 
+http_client: Optional[AsyncClient] = None
+redis_client: Optional[aioredis.Redis] = None
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global http_client, redis_client
+    http_client = AsyncClient(timeout=5.0, limits=Limits(max_keepalive_connections=100, max_connections=200))
+    redis_client = aioredis.from_url(REDIS_URL, decode_responses=True)
     async with engine.begin() as conn:
 
         await conn.run_sync(SQLModel.metadata.create_all)
         yield
+    await http_client.aclose()
+    await redis_client.aclose()
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 
-async def get_session() -> Session:
-    async with Session(engine) as session:
+async def get_session() -> AsyncSession:
+    async with SessionLocal() as session:
         yield session
 
 
-async def verify_token(token: str) -> dict:
-    async with AsyncClient() as client:
-        headers = {"Authorization": f"Bearer {token}"}
-        response = await client.get(AUTH_SERVICE_URL, headers=headers)
-        if response.status_code != 200 or not response.json().get("valid"):
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-        return response.json()
+token_cache = TTLCache(maxsize=10_000, ttl=60)
 
 
-async def verify_user_role(user_id: int):
-    async with AsyncClient() as client:
-        response = await client.get(f"{ACCOUNT_SERVICE_URL}{user_id}")
-        if response.status_code != 200 or response.json().get("role") != "user":
+async def verify_token(token: str) -> dict:
+    cached = token_cache.get(token)
+    if cached is not None and cached.get("exp", 0) > time.time():
+        return cached
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    token_cache[token] = payload
+    return payload
+
+
+role_cache = TTLCache(maxsize=10_000, ttl=60)
+
+
+async def verify_user_role(user_id: int, token: str):
+    role = role_cache.get(user_id)
+    if role is None:
+        try:
+            role = await redis_client.get(f"role:{user_id}")
+        except aioredis.RedisError:
+            role = None
+    if role is None:
+        headers = {"Authorization": f"Bearer {token}"}
+        response = await http_client.get(f"{ACCOUNT_SERVICE_URL}roles", params={"ids": user_id}, headers=headers)
+        if response.status_code != 200:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pacient role")
+        role = response.json().get(str(user_id))
+        if role is not None:
+            role_cache[user_id] = role
+            try:
+                await redis_client.set(f"role:{user_id}", role, ex=60)
+            except aioredis.RedisError:
+                pass
+    if role != "user":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pacient role")
 
 
 async def doctor_or_owner_required(
     history_id: int,
     token: dict = Depends(verify_token),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_session)
 ):
-    statement = select(History).where(History.id == history_id)
+    statement = select(History.pacient_id).where(History.id == history_id)
     result = await session.execute(statement)
-    history = result.scalars().first()
+    row = result.first()
 
-    if not history or (token["role"] != "doctor" and token["user_id"] != history.pacient_id):
+    if row is None or (token["role"] != "doctor" and token["user_id"] != row[0]):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
 
 async def admin_or_medical_required(token: dict = Depends(verify_token)):
@@ -90,20 +145,20 @@ async def admin_or_medical_required(token: dict = Depends(verify_token)):
 
 
 
-@app.get("/api/History/Account/{id}", response_model=List[History])
+@app.get("/api/History/Account/{id}")
 async def get_history_by_account(
     id: int,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     token: dict = Depends(verify_token)
 ):
-    statement = select(History).where(History.pacient_id == id)
+    statement = lambda_stmt(lambda: select(History.__table__).where(History.pacient_id == id))
     result = await session.execute(statement)
-    return result.scalars().all()
+    return [dict(row) for row in result.mappings().all()]
 
 @app.get("/api/History/{id}", response_model=History)
 async def get_history_details(
     id: int,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     token: dict = Depends(doctor_or_owner_required)
 ):
     history = await session.get(History, id)
@@ -114,21 +169,26 @@ async def get_history_details(
 @app.post("/api/History", response_model=History, status_code=status.HTTP_201_CREATED)
 async def create_history(
     history: HistoryCreate,
-    session: Session = Depends(get_session),
-    token: dict = Depends(admin_or_medical_required)
+    token: str,
+    session: AsyncSession = Depends(get_session)
 ):
-    await verify_user_role(history.pacient_id)
+    payload, _ = await asyncio.gather(
+        verify_token(token),
+        verify_user_role(history.pacient_id, token)
+    )
+    if payload["role"] not in ["admin", "manager", "doctor"]:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+
     new_history = History(**history.dict())
     session.add(new_history)
     await session.commit()
-    await session.refresh(new_history)
     return new_history
 
 @app.put("/api/History/{id}", response_model=History)
 async def update_history(
     id: int,
     updated_history: HistoryUpdate,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     token: dict = Depends(admin_or_medical_required)
 ):
     history = await session.get(History, id)
@@ -139,5 +199,4 @@ async def update_history(
         setattr(history, key, value)
 
     await session.commit()
-    await session.refresh(history)
     return history
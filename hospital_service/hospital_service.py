@@ -1,31 +1,53 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Query
-from sqlmodel import SQLModel, Field, create_engine, Session, select
+from fastapi.responses import ORJSONResponse
+from sqlmodel import SQLModel, Field, Relationship, select
+from sqlalchemy import exists, lambda_stmt
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker, selectinload
 from typing import List, Optional
-from httpx import AsyncClient
-import asyncio
+from cachetools import TTLCache
+from jose import JWTError, jwt
+import os
+import time
 
 from contextlib import asynccontextmanager
 
 
 DATABASE_URL = 'postgresql+asyncpg://user:password@db:5432/hospital_db'
-AUTH_SERVICE_URL = 'http://localhost:8081/api/Authentication/Validate'
-ACCOUNT_SERVICE_URL = 'http://localhost:8081/api/Accounts/'
-HOSPITAL_SERVICE_URL = 'http://localhost:8082/api/Hospitals/'
+SECRET_KEY = os.getenv("JWT_SECRET", "key")
+ALGORITHM = "HS256"
 
 
-engine = create_engine(DATABASE_URL, echo=True, future=True)
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=bool(int(os.getenv("SQL_ECHO", "0"))),
+    pool_size=20,
+    max_overflow=10,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    query_cache_size=1200
+)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine, class_=AsyncSession)
 
 
 class Room(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
-    hospital_id: Optional[int] = Field(default=None, foreign_key="hospital.id")
+    hospital_id: Optional[int] = Field(default=None, foreign_key="hospital.id", index=True)
+    hospital: Optional["Hospital"] = Relationship(back_populates="rooms")
 
 class Hospital(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
     address: str
     contact_phone: str
+    rooms: List[Room] = Relationship(back_populates="hospital")
+
+class HospitalRead(SQLModel):
+    id: int
+    name: str
+    address: str
+    contact_phone: str
     rooms: List[Room] = []
 
 
@@ -36,22 +58,26 @@ async def lifespan(app: FastAPI):
         await conn.run_sync(SQLModel.metadata.create_all)
         yield
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
-async def get_session() -> Session:
-    async with Session(engine) as session:
+async def get_session() -> AsyncSession:
+    async with SessionLocal() as session:
         yield session
 
 
-async def verify_token(token: str) -> dict:
-    async with AsyncClient() as client:
-        headers = {"Authorization": f"Bearer {token}"}
-        response = await client.get(AUTH_SERVICE_URL, headers=headers)
+token_cache = TTLCache(maxsize=10_000, ttl=60)
 
-        if response.status_code != 200 or not response.json().get("valid"):
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
-        return response.json()
+async def verify_token(token: str) -> dict:
+    cached = token_cache.get(token)
+    if cached is not None and cached.get("exp", 0) > time.time():
+        return cached
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    token_cache[token] = payload
+    return payload
 
 
 async def admin_required(token: dict = Depends(verify_token)):
@@ -60,56 +86,64 @@ async def admin_required(token: dict = Depends(verify_token)):
 
 
 
-@app.get("/api/Hospitals", response_model=List[Hospital])
+@app.get("/api/Hospitals", response_model=List[HospitalRead])
 async def get_hospitals(
     from_: int = Query(0, alias="from"),
     count: int = Query(10),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     token: dict = Depends(verify_token)
 ):
-    statement = select(Hospital).offset(from_).limit(count)
+    statement = select(Hospital).options(selectinload(Hospital.rooms)).offset(from_).limit(count)
     result = await session.execute(statement)
     hospitals = result.scalars().all()
     return hospitals
 
-@app.get("/api/Hospitals/{id}", response_model=Hospital)
+@app.get("/api/Hospitals/{id}", response_model=HospitalRead)
 async def get_hospital(
     id: int,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     token: dict = Depends(verify_token)
 ):
-    hospital = await session.get(Hospital, id)
+    hospital = await session.get(Hospital, id, options=[selectinload(Hospital.rooms)])
     if not hospital:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Hospital not found")
     return hospital
 
-@app.get("/api/Hospitals/{id}/Rooms", response_model=List[Room])
+@app.head("/api/Hospitals/{id}")
+async def hospital_exists(
+    id: int,
+    session: AsyncSession = Depends(get_session)
+):
+    statement = select(exists().where(Hospital.id == id))
+    result = await session.execute(statement)
+    if not result.scalar():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Hospital not found")
+
+@app.get("/api/Hospitals/{id}/Rooms")
 async def get_hospital_rooms(
     id: int,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     token: dict = Depends(verify_token)
 ):
-    statement = select(Room).where(Room.hospital_id == id)
+    statement = lambda_stmt(lambda: select(Room.__table__).where(Room.hospital_id == id))
     result = await session.execute(statement)
-    rooms = result.scalars().all()
-    return rooms
+    return [dict(row) for row in result.mappings().all()]
 
 @app.post("/api/Hospitals", response_model=Hospital, status_code=status.HTTP_201_CREATED)
 async def create_hospital(
     hospital: Hospital,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     token: dict = Depends(admin_required)
 ):
     session.add(hospital)
     await session.commit()
-    await session.refresh(hospital)
     return hospital
 
 @app.put("/api/Hospitals/{id}", response_model=Hospital)
 async def update_hospital(
     id: int,
     updated_hospital: Hospital,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     token: dict = Depends(admin_required)
 ):
     hospital = await session.get(Hospital, id)
@@ -125,7 +159,7 @@ async def update_hospital(
 @app.delete("/api/Hospitals/{id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_hospital(
     id: int,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     token: dict = Depends(admin_required)
 ):
     hospital = await session.get(Hospital, id)
@@ -1,18 +1,39 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Query, Path
-from sqlmodel import SQLModel, Field, create_engine, Session, select
+from fastapi.responses import ORJSONResponse
+from sqlmodel import SQLModel, Field, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Index, lambda_stmt
 from typing import List, Optional
 from datetime import datetime, timedelta
-from httpx import AsyncClient
+from httpx import AsyncClient, Limits
+from cachetools import TTLCache
+from jose import JWTError, jwt
 from contextlib import asynccontextmanager
+import asyncio
+import os
+import time
 
 
 DATABASE_URL = 'postgresql+asyncpg://user:password@db:5432/timetable_db'
-AUTH_SERVICE_URL = 'http://localhost:8081/api/Authentication/Validate'
+SECRET_KEY = os.getenv("JWT_SECRET", "key")
+ALGORITHM = "HS256"
 HOSPITAL_SERVICE_URL = 'http://localhost:8082/api/Hospitals/'
 
-engine = create_engine(DATABASE_URL, echo=True, future=True)
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=bool(int(os.getenv("SQL_ECHO", "0"))),
+    pool_size=20,
+    max_overflow=10,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    query_cache_size=1200
+)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine, class_=AsyncSession)
 
 class Timetable(SQLModel, table=True):
+    __table_args__ = (Index("ix_timetable_hospital_from_to", "hospital_id", "from_time", "to_time"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     hospital_id: int
     doctor_id: int
@@ -38,33 +59,45 @@ class AppointmentCreate(SQLModel):
 
 
 
+http_client: Optional[AsyncClient] = None
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global http_client
+    http_client = AsyncClient(timeout=5.0, limits=Limits(max_keepalive_connections=100, max_connections=200))
     async with engine.begin() as conn:
 
         await conn.run_sync(SQLModel.metadata.create_all)
         yield
+    await http_client.aclose()
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 
-async def get_session() -> Session:
-    async with Session(engine) as session:
+async def get_session() -> AsyncSession:
+    async with SessionLocal() as session:
         yield session
 
+token_cache = TTLCache(maxsize=10_000, ttl=60)
+
+
 async def verify_token(token: str) -> dict:
-    async with AsyncClient() as client:
-        headers = {"Authorization": f"Bearer {token}"}
-        response = await client.get(AUTH_SERVICE_URL, headers=headers)
-        if response.status_code != 200 or not response.json().get("valid"):
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-        return response.json()
+    cached = token_cache.get(token)
+    if cached is not None and cached.get("exp", 0) > time.time():
+        return cached
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    token_cache[token] = payload
+    return payload
+
 
 async def hospital_exists(hospital_id: int):
-    async with AsyncClient() as client:
-        response = await client.get(f"{HOSPITAL_SERVICE_URL}{hospital_id}")
-        if response.status_code != 200:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Hospital not found")
+    response = await http_client.head(f"{HOSPITAL_SERVICE_URL}{hospital_id}")
+    if response.status_code != 200:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Hospital not found")
 
 async def admin_or_manager_required(token: dict = Depends(verify_token)):
     if token.get("role") not in ["admin", "manager"]:
@@ -72,34 +105,41 @@ async def admin_or_manager_required(token: dict = Depends(verify_token)):
 
 
 def validate_time_range(from_time: datetime, to_time: datetime):
-    if to_time <= from_time:
+    from_ts = int(from_time.timestamp())
+    to_ts = int(to_time.timestamp())
+    duration = to_ts - from_ts
+    if duration <= 0:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'to' must be after 'from'")
-    if (to_time - from_time).total_seconds() > 12 * 3600:
+    if duration > 12 * 3600:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Duration cannot exceed 12 hours")
-    if from_time.minute % 30 != 0 or to_time.minute % 30 != 0 or from_time.second != 0 or to_time.second != 0:
+    if from_ts % 1800 != 0 or to_ts % 1800 != 0:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Minutes must be a multiple of 30")
 
 
 @app.post("/api/Timetable", response_model=Timetable, status_code=status.HTTP_201_CREATED)
 async def create_timetable(
     timetable: TimetableCreate,
-    session: Session = Depends(get_session),
-    token: dict = Depends(admin_or_manager_required)
+    token: str,
+    session: AsyncSession = Depends(get_session)
 ):
     validate_time_range(timetable.from_time, timetable.to_time)
-    await hospital_exists(timetable.hospital_id)
+    payload, _ = await asyncio.gather(
+        verify_token(token),
+        hospital_exists(timetable.hospital_id)
+    )
+    if payload.get("role") not in ["admin", "manager"]:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admins or managers allowed")
 
     new_timetable = Timetable(**timetable.dict())
     session.add(new_timetable)
     await session.commit()
-    await session.refresh(new_timetable)
     return new_timetable
 
 @app.put("/api/Timetable/{id}", response_model=Timetable)
 async def update_timetable(
     id: int,
     timetable: TimetableCreate,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     token: dict = Depends(admin_or_manager_required)
 ):
     validate_time_range(timetable.from_time, timetable.to_time)
@@ -111,13 +151,12 @@ async def update_timetable(
         setattr(existing_timetable, key, value)
 
     await session.commit()
-    await session.refresh(existing_timetable)
     return existing_timetable
 
 @app.delete("/api/Timetable/{id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_timetable(
     id: int,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     token: dict = Depends(admin_or_manager_required)
 ):
     timetable = await session.get(Timetable, id)
@@ -127,18 +166,25 @@ async def delete_timetable(
     await session.delete(timetable)
     await session.commit()
 
-@app.get("/api/Timetable/Hospital/{id}", response_model=List[Timetable])
+@app.get("/api/Timetable/Hospital/{id}")
 async def get_timetable_for_hospital(
     id: int,
     from_time: datetime,
     to_time: datetime,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     token: dict = Depends(verify_token)
 ):
-    statement = select(Timetable).where(
+    statement = lambda_stmt(lambda: select(
+        Timetable.id,
+        Timetable.hospital_id,
+        Timetable.doctor_id,
+        Timetable.room,
+        Timetable.from_time.label("from"),
+        Timetable.to_time.label("to")
+    ).where(
         Timetable.hospital_id == id,
         Timetable.from_time >= from_time,
         Timetable.to_time <= to_time
-    )
+    ))
     result = await session.execute(statement)
-    return result.scalars().all()
+    return [dict(row) for row in result.mappings().all()]